@@ -1,4 +1,6 @@
 #!/usr/bin/python
 
 from .roller import HistogramRoller, CounterRoller
-from .updater import start_update_daemon, PrometheusRollingMetricsUpdater
+from .updater import start_update_daemon, PrometheusRollingMetricsUpdater, UpdaterWatchdog
+from .shared import SharedRollerPublisher, SharedRollerReader
+from .clock import SystemClock, SimulatedClock
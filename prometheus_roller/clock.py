@@ -0,0 +1,48 @@
+from __future__ import division, print_function
+
+import time
+import datetime
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class SystemClock(object):
+    """Clock backed by the real time, used by rollers and the updater by default.
+    """
+    def now(self):
+        return datetime.datetime.now()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class SimulatedClock(object):
+    """Clock that only moves when told to, for running rollers faster than real time.
+    Sleeping advances the clock instantly.
+
+    `start` is in seconds since the epoch.
+    """
+    def __init__(self, start=0.0):
+        self.current = start
+
+    def now(self):
+        # Naive UTC, so simulated time never jumps backwards across DST changes
+        return EPOCH + datetime.timedelta(seconds=self.current)
+
+    def time(self):
+        return self.current
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        self.current += seconds
+
+    def set(self, current):
+        self.current = current
+
+
+SYSTEM_CLOCK = SystemClock()
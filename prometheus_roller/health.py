@@ -0,0 +1,108 @@
+from __future__ import division, print_function
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Quarantine a roller after 3 consecutive failed or slow updates
+DEFAULT_MAX_FAILURES = 3
+DEFAULT_MAX_OVERRUNS = 3
+
+# An update taking longer than 1 second is slow
+DEFAULT_LATENCY_BUDGET = 1.0
+
+# Quarantine for 1 minute at first, doubling up to 1 hour while the roller keeps misbehaving
+DEFAULT_QUARANTINE_PERIOD = 60
+MAX_QUARANTINE_PERIOD = 60*60
+
+# Keys are registries
+# Values are the UpdaterMetrics registered with them, shared by every updater using that registry
+UPDATER_METRICS = dict()
+
+
+class RollerHealth(object):
+    """Tracks consecutive failed and slow updates of a single roller.
+    """
+    def __init__(self, quarantine_seconds=DEFAULT_QUARANTINE_PERIOD):
+        self.failures = 0
+        self.overruns = 0
+        self.quarantined_until = None
+
+        # Length of the next quarantine
+        self.quarantine_seconds = quarantine_seconds
+
+    def is_quarantined(self, now):
+        return self.quarantined_until is not None and now < self.quarantined_until
+
+    def quarantine(self, now):
+        """Quarantine until `quarantine_seconds` from now and double the next quarantine.
+        """
+        self.quarantined_until = now + self.quarantine_seconds
+        self.quarantine_seconds = min(self.quarantine_seconds*2, MAX_QUARANTINE_PERIOD)
+
+
+class UpdaterMetrics(object):
+    """Metrics describing the health of a PrometheusRollingMetricsUpdater and its rollers.
+    """
+    def __init__(self, registry):
+        self.errors = Counter(
+            'prometheus_roller_update_errors',
+            'Number of roller updates that raised an exception',
+            labelnames=('roller',),
+            registry=registry
+        )
+        self.overruns = Counter(
+            'prometheus_roller_update_overruns',
+            'Number of roller updates that took longer than the latency budget',
+            labelnames=('roller',),
+            registry=registry
+        )
+        self.tick_duration = Histogram(
+            'prometheus_roller_tick_duration_seconds',
+            'Time taken to update all rollers that were due',
+            registry=registry
+        )
+        self.slowest_update = Gauge(
+            'prometheus_roller_slowest_update_seconds',
+            'Time taken by the slowest roller update in the last tick',
+            registry=registry
+        )
+        self.quarantines = Counter(
+            'prometheus_roller_quarantines',
+            'Number of times a roller was quarantined',
+            labelnames=('roller',),
+            registry=registry
+        )
+        self.quarantined = Gauge(
+            'prometheus_roller_quarantined',
+            'Whether a roller is currently quarantined',
+            labelnames=('roller',),
+            registry=registry
+        )
+        self.publish_errors = Counter(
+            'prometheus_roller_publish_errors',
+            'Number of times publishing rolled values raised an exception',
+            registry=registry
+        )
+        self.last_tick = Gauge(
+            'prometheus_roller_updater_last_tick_timestamp_seconds',
+            'Time the updater last finished a tick, in seconds since the epoch',
+            registry=registry
+        )
+        self.stalled = Gauge(
+            'prometheus_roller_updater_stalled',
+            'Whether the updater has not finished a tick for longer than expected',
+            registry=registry
+        )
+        self.restarts = Counter(
+            'prometheus_roller_updater_restarts',
+            'Number of times the watchdog restarted the updater thread',
+            registry=registry
+        )
+
+
+def get_updater_metrics(registry):
+    """Return the UpdaterMetrics for a registry, creating them the first time.
+    """
+    metrics = UPDATER_METRICS.get(registry)
+    if metrics is None:
+        metrics = UPDATER_METRICS[registry] = UpdaterMetrics(registry)
+    return metrics
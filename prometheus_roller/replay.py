@@ -0,0 +1,234 @@
+"""Replay a recorded series of counter and histogram values through rollers on a simulated clock,
+as fast as possible.
+
+A trace is a list of (seconds, values) points in time order, where `values` maps metric names to
+a counter value or a dict of cumulative histogram bucket counts keyed by 'le' value, e.g.
+
+    [(0, {'requests': 0.0, 'latency': {'0.5': 0, '+Inf': 0}}),
+     (1, {'requests': 3.0, 'latency': {'0.5': 2, '+Inf': 3}})]
+
+Saved as JSON lines ({"time": ..., "values": {...}} per line) a trace can be replayed with
+
+    python -m prometheus_roller.replay trace.jsonl --reducer max --update-seconds 5
+
+Points don't need to line up with roller update periods: the updater ticks on its usual schedule,
+seeing the values of the latest point at or before each tick.
+"""
+
+from __future__ import division, print_function
+
+import sys
+import json
+import timeit
+import argparse
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import CounterMetricFamily, HistogramMetricFamily
+from .roller import CounterRoller, HistogramRoller, REDUCERS
+from .updater import PrometheusRollingMetricsUpdater
+from .clock import SimulatedClock
+
+
+##########
+# Sources
+##########
+
+class ReplayCounter(object):
+    """Stands in for a prometheus Counter, reporting whatever value it was last set to.
+    """
+    _type = 'counter'
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def collect(self):
+        return [CounterMetricFamily(self.name, 'Replayed counter', value=self.value)]
+
+
+class ReplayHistogram(object):
+    """Stands in for a prometheus Histogram, reporting whatever bucket counts it was last set to.
+    """
+    _type = 'histogram'
+
+    def __init__(self, name, buckets):
+        self.name = name
+        self.bucket_labels = sorted(buckets, key=float)
+        self.set(dict())
+
+    def set(self, value):
+        """Set bucket counts, buckets missing from `value` are 0
+        """
+        self.buckets = [(le, value.get(le, 0)) for le in self.bucket_labels]
+
+    def collect(self):
+        return [HistogramMetricFamily(self.name, 'Replayed histogram', buckets=self.buckets, sum_value=0.0)]
+
+
+def make_sources(trace):
+    """Create a source for every metric in a trace, starting from zero.
+    Histograms get every bucket seen for them anywhere in the trace.
+    """
+    # Keys are metric names
+    # Values are sets of bucket labels for histograms, None for counters
+    metrics = dict()
+    for _, values in trace:
+        for name, value in values.items():
+            if isinstance(value, dict):
+                metrics.setdefault(name, set()).update(value.keys())
+            else:
+                metrics.setdefault(name, None)
+
+    sources = dict()
+    for name, buckets in metrics.items():
+        if buckets is None:
+            sources[name] = ReplayCounter(name)
+        else:
+            sources[name] = ReplayHistogram(name, buckets)
+    return sources
+
+
+##########
+# Replay
+##########
+
+class ReplayResult(object):
+    """Rolled outputs and timing of a replay.
+
+    `ticks` is the number of updater ticks, `points` the number of trace points.
+    `outputs` holds (seconds, {roller name: rolled values}) after every trace point when recorded.
+    """
+    def __init__(self, points, ticks, elapsed_seconds, outputs):
+        self.points = points
+        self.ticks = ticks
+        self.elapsed_seconds = elapsed_seconds
+        self.outputs = outputs
+
+    @property
+    def ticks_per_second(self):
+        if self.elapsed_seconds > 0:
+            return self.ticks/self.elapsed_seconds
+        return float('inf')
+
+
+class Replay(object):
+    """Feeds a trace through a set of rollers driven by a PrometheusRollingMetricsUpdater.
+
+    Extra keyword arguments are passed to the updater (e.g. `adaptive=True`). To keep replays
+    deterministic, roller exceptions are raised rather than isolated, and there is no latency budget.
+    """
+    def __init__(self, trace, start=0, **kwargs):
+        self.trace = trace
+        self.start = start
+        self.clock = SimulatedClock(start)
+        self.registry = CollectorRegistry()
+        self.roller_registry = dict()
+
+        kwargs.setdefault('isolate_failures', False)
+        kwargs.setdefault('latency_budget', None)
+        self.updater = PrometheusRollingMetricsUpdater(clock=self.clock, **kwargs)
+
+        # Keys are metric names
+        # Metrics that first show up part way through the trace are zero until then
+        self.sources = make_sources(trace)
+
+    def add_roller(self, metric_name, options=None):
+        """Create a roller tracking a metric from the trace and return it.
+        """
+        source = self.sources[metric_name]
+        roller_cls = HistogramRoller if source._type == 'histogram' else CounterRoller
+        roller = roller_cls(
+            source,
+            options=options,
+            registry=self.registry,
+            roller_registry=self.roller_registry,
+            clock=self.clock
+        )
+        self.updater.add(roller)
+        return roller
+
+    def run(self, record=True):
+        """Replay every point of the trace and return a ReplayResult.
+        Only feeding values and updating rollers is timed, not recording outputs.
+        """
+        outputs = []
+        ticks = 0
+        elapsed_seconds = 0.0
+        wait_period = self.updater.wait_period
+        next_tick = None
+        for seconds, values in self.trace:
+            started = timeit.default_timer()
+            now = self.start + seconds
+            if next_tick is None:
+                next_tick = now + (-now % wait_period)
+
+            # Ticks before this point see the values of the previous one
+            while next_tick < now:
+                self.clock.set(next_tick)
+                self.updater.tick()
+                ticks += 1
+                next_tick += wait_period
+
+            self.clock.set(now)
+            for name, value in values.items():
+                self.sources[name].set(value)
+
+            if next_tick == now:
+                self.updater.tick()
+                ticks += 1
+                next_tick += wait_period
+            elapsed_seconds += timeit.default_timer() - started
+
+            if record:
+                outputs.append((seconds, dict(
+                    (roller.name, dict(roller.rolled_values)) for roller in self.updater.rollers
+                )))
+
+        return ReplayResult(len(self.trace), ticks, elapsed_seconds, outputs)
+
+
+def load_trace(path):
+    """Load a trace saved as JSON lines.
+    """
+    trace = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                tick = json.loads(line)
+                trace.append((tick['time'], tick['values']))
+    return trace
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a recorded trace through rollers as fast as possible.')
+    parser.add_argument('trace', help='JSON lines file with one {"time": ..., "values": {...}} object per tick')
+    parser.add_argument('--reducer', default='sum', choices=sorted(REDUCERS.keys()))
+    parser.add_argument('--update-seconds', type=int, default=None)
+    parser.add_argument('--retention-seconds', type=int, default=None)
+    parser.add_argument('--adaptive', action='store_true', help='Skip recalculating rolled values while a metric is not changing')
+    args = parser.parse_args(argv)
+
+    options = {'reducer': args.reducer}
+    if args.update_seconds is not None:
+        options['update_seconds'] = args.update_seconds
+    if args.retention_seconds is not None:
+        options['retention_seconds'] = args.retention_seconds
+
+    replay = Replay(load_trace(args.trace), adaptive=args.adaptive)
+    for metric_name in sorted(replay.sources.keys()):
+        replay.add_roller(metric_name, options=dict(options))
+    result = replay.run(record=False)
+
+    print('Replayed %d points as %d ticks in %.3f seconds (%.1f ticks per second)' % (
+        result.points, result.ticks, result.elapsed_seconds, result.ticks_per_second))
+    for roller in replay.updater.rollers:
+        print('%s %s' % (roller.name, json.dumps(roller.rolled_values, sort_keys=True)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,7 @@ from __future__ import division, print_function
 import datetime
 from collections import deque
 from prometheus_client import Gauge, REGISTRY
+from .clock import SYSTEM_CLOCK
 
 # Keep track of rollers created by the user
 ROLLER_REGISTRY = dict()
@@ -12,6 +13,25 @@ ROLLER_REGISTRY = dict()
 # Utility
 ##########
 
+class PastValues(deque):
+    """Deque of (time, value) pairs that keeps count of the nonzero deltas between them,
+    so checking for a flat window doesn't assume values only go up (counters can reset).
+    """
+    def __init__(self):
+        super(PastValues, self).__init__()
+        self.nonzero_deltas = 0
+
+    def append(self, item):
+        if len(self) and item[1] != self[-1][1]:
+            self.nonzero_deltas += 1
+        super(PastValues, self).append(item)
+
+    def popleft(self):
+        item = super(PastValues, self).popleft()
+        if len(self) and item[1] != self[0][1]:
+            self.nonzero_deltas -= 1
+        return item
+
 def iter_hist_buckets(hist):
     """Return buckets for a histogram as a generator
     """
@@ -29,6 +49,11 @@ def remove_old_values(past_values, earliest_allowed_time):
         else:
             break
 
+def is_flat(past_values):
+    """True if a PastValues deque has not changed, so all deltas are 0
+    """
+    return len(past_values) > 1 and past_values.nonzero_deltas == 0
+
 def values_to_deltas(past_values):
     """Turn a deque holding past gauge values into a list of deltas.
     These should be evenly distributed in time.
@@ -155,15 +180,17 @@ class RollerBase(object):
 class CounterRoller(RollerBase):
     """Accepts a Counter object and creates a gauge tracking its value over a given time period.
     """
-    def __init__(self, counter, options=None, registry=REGISTRY, roller_registry=ROLLER_REGISTRY):
+    def __init__(self, counter, options=None, registry=REGISTRY, roller_registry=ROLLER_REGISTRY, clock=SYSTEM_CLOCK):
         self.counter = counter
+        self.clock = clock
         if self.counter._type != 'counter':
             raise ValueError('Only a Counter object should be passed to CounterRoller')
 
         options = options or {}
         self.extract_options(options)
 
-        self.past_values = deque()
+        self.past_values = PastValues()
+        self.rolled_values = dict()
         full_name, _, _ = self.get_sample()
         self.configure_with_full_name(full_name)
 
@@ -180,10 +207,15 @@ class CounterRoller(RollerBase):
         """
         return self.counter.collect()[0].samples[0]
 
-    def collect(self):
+    def collect(self, skip_unchanged=False):
         """Update tracked counter values and current gauge value
+
+        With `skip_unchanged`, the reducer is not run when the window was and still is flat,
+        since the rolled value can't have changed. This assumes the reducer returns the same
+        value for any number of 0 deltas, which is true for all built in reducers.
         """
-        now = datetime.datetime.now()
+        now = self.clock.now()
+        was_flat = is_flat(self.past_values)
 
         # Fetch value from counter
         _, _, value = self.get_sample()
@@ -194,17 +226,27 @@ class CounterRoller(RollerBase):
         # Drop old values
         remove_old_values(self.past_values, now - self.retention_td)
 
+        if skip_unchanged and was_flat and is_flat(self.past_values):
+            return
+
         # Calculate and record new rolled value
         v = self.reducer(values_to_deltas(self.past_values), **self.reducer_kwargs)
         self.gauge.set(v)
+        self.rolled_values[''] = v
+
+    def is_flat(self):
+        """True if the counter has not changed over the retention window, so all deltas are 0
+        """
+        return is_flat(self.past_values)
 
 
 class HistogramRoller(RollerBase):
     """Accepts a Histogram object and creates a guage with multiple labels tracking bucket values
     over a given time period.
     """
-    def __init__(self, histogram, options=None, registry=REGISTRY, roller_registry=ROLLER_REGISTRY):
+    def __init__(self, histogram, options=None, registry=REGISTRY, roller_registry=ROLLER_REGISTRY, clock=SYSTEM_CLOCK):
         self.hist = histogram
+        self.clock = clock
         if self.hist._type != 'histogram':
             raise ValueError('Only a Histogram object should be passed to HistogramRoller')
 
@@ -214,10 +256,11 @@ class HistogramRoller(RollerBase):
         # Keys are 'le' values
         # Holds deques containing values for each gauge
         self.past_values = dict()
+        self.rolled_values = dict()
         full_name = ""
         for full_name, labels, _ in iter_hist_buckets(self.hist):
             le_label = labels['le']
-            self.past_values[le_label] = deque()
+            self.past_values[le_label] = PastValues()
 
         self.configure_with_full_name(full_name, is_histogram=True)
 
@@ -231,18 +274,22 @@ class HistogramRoller(RollerBase):
 
         roller_registry[self.name] = self
 
-    def collect(self):
+    def collect(self, skip_unchanged=False):
         """Loop over current histogram bucket values and update gauges.
 
+        With `skip_unchanged`, the reducer is not run for buckets whose window was and still is
+        flat, as in CounterRoller.collect.
+
         Usage:
         * Collect should only be called about every second, not in a tight loop.
         * Should only be called in 1 thread at a time.
         """
-        now = datetime.datetime.now()
+        now = self.clock.now()
 
         # Fetch values from histograms
         for _, labels, value in iter_hist_buckets(self.hist):
             sample_key = labels['le']
+            was_flat = is_flat(self.past_values[sample_key])
 
             # Add value
             self.past_values[sample_key].append((now, value))
@@ -250,9 +297,18 @@ class HistogramRoller(RollerBase):
             # Drop old values
             remove_old_values(self.past_values[sample_key], now - self.retention_td)
 
+            if skip_unchanged and was_flat and is_flat(self.past_values[sample_key]):
+                continue
+
             # Calculate and record new rolled value
             v = self.reducer(values_to_deltas(self.past_values[sample_key]), **self.reducer_kwargs)
             self.gauge.labels({'le': sample_key}).set(v)
+            self.rolled_values[sample_key] = v
 
-
-
+    def is_flat(self):
+        """True if no bucket has changed over the retention window, so all deltas are 0
+        """
+        for past_values in self.past_values.values():
+            if not is_flat(past_values):
+                return False
+        return True
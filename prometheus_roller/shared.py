@@ -0,0 +1,277 @@
+from __future__ import division, print_function
+
+import time
+import struct
+import logging
+from .roller import ROLLER_REGISTRY
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    # Only available in python >= 3.8
+    shared_memory = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_NAME = 'prometheus_roller'
+DEFAULT_SEGMENT_SIZE = 1024*1024    # 1 MiB
+
+# Segment layout:
+# * header: magic, sequence number, number of entries, layout generation
+# * entries: (roller name, 'le' label, rolled value), '' label for counters
+# Entries keep their slot until the set of entries changes, which bumps the layout generation.
+HEADER = struct.Struct('<8sQII')
+ENTRY = struct.Struct('<128s32sd')
+VALUE = struct.Struct('<d')
+MAGIC = b'PROMROLL'
+NAME_SIZE = 128
+LABEL_SIZE = 32
+
+# Offsets into the header and into each entry
+SEQ_OFFSET = 8
+COUNT_OFFSET = 16
+GENERATION_OFFSET = 20
+VALUE_OFFSET = NAME_SIZE + LABEL_SIZE
+
+# How many times a reader retries while the writer holds the seqlock
+MAX_READ_ATTEMPTS = 1000
+
+# Names of segments published from this process
+PUBLISHED_SEGMENTS = set()
+
+
+##########
+# Utility
+##########
+
+def check_shared_memory():
+    if shared_memory is None:
+        raise RuntimeError("Sharing rolled values requires 'multiprocessing.shared_memory' (python >= 3.8)")
+
+def encode_field(value, size):
+    """Encode a string for a fixed width field, returning None if it does not fit
+    """
+    encoded = value.encode('utf-8')
+    if len(encoded) > size:
+        return None
+    return encoded
+
+def attach_untracked(name):
+    """Attach to an existing segment without letting this process's resource tracker
+    unlink it on exit; the publisher owns the segment.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # 'track' was added in python 3.13
+        shm = shared_memory.SharedMemory(name=name)
+        # The tracker only holds one entry per segment, which the publisher needs if it is local
+        if name not in PUBLISHED_SEGMENTS:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+def decode_field(value):
+    return value.rstrip(b'\x00').decode('utf-8')
+
+
+##########
+# Writer
+##########
+
+class SharedRollerPublisher(object):
+    """Publishes the latest rolled values of every roller in a roller registry to a shared memory
+    segment, so other processes can read them without scraping this one.
+
+    Writes are guarded by a seqlock: the sequence number is odd while a write is in progress.
+    Only one process should publish to a given segment. If the segment already exists, e.g. left
+    behind by a previous run that did not close it, pass `takeover=True` to reuse it.
+    """
+    def __init__(self, name=DEFAULT_SEGMENT_NAME, size=DEFAULT_SEGMENT_SIZE, roller_registry=ROLLER_REGISTRY,
+                 takeover=False):
+        check_shared_memory()
+        if size < HEADER.size:
+            raise ValueError("'size' must be at least %d bytes" % (HEADER.size))
+
+        self.roller_registry = roller_registry
+        self.capacity = (size - HEADER.size) // ENTRY.size
+        self.seq = 0
+        self.generation = 0
+
+        # Keys are (roller name, label), values are slot numbers
+        self.slots = dict()
+
+        # (roller name, label) pairs that can't be published, only logged once
+        self.rejected = set()
+
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            if not takeover:
+                raise FileExistsError("Shared memory segment '%s' already exists; pick another name, "
+                    "or pass takeover=True if it was left behind by a previous run of this publisher" % (name))
+            self.shm = shared_memory.SharedMemory(name=name)
+            if self.shm.size < size:
+                self.shm.close()
+                raise ValueError("Existing shared memory segment '%s' is smaller than %d bytes" % (name, size))
+            _, self.seq, _, self.generation = HEADER.unpack_from(self.shm.buf, 0)
+            if self.seq % 2:
+                self.seq += 1
+            self.generation += 1
+
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, self.seq, 0, self.generation)
+        PUBLISHED_SEGMENTS.add(name)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def accept(self, key):
+        """Check that a (roller name, label) pair fits in an entry, logging it once if not.
+        """
+        if key in self.rejected:
+            return False
+        roller_name, label = key
+        if encode_field(roller_name, NAME_SIZE) is None or encode_field(label, LABEL_SIZE) is None:
+            logger.warning("Not publishing roller '%s' label '%s': names are limited to %d bytes and labels to %d bytes",
+                roller_name, label, NAME_SIZE, LABEL_SIZE)
+            self.rejected.add(key)
+            return False
+        return True
+
+    def publish(self):
+        """Write the current rolled values of all registered rollers into the segment.
+        Names are only rewritten when the set of published values changes.
+        """
+        values = dict()
+        for roller_name, roller in list(self.roller_registry.items()):
+            for label, value in list(roller.rolled_values.items()):
+                key = (roller_name, label)
+                if key in self.slots or self.accept(key):
+                    values[key] = value
+
+        if len(values) > self.capacity:
+            raise ValueError("%d rolled values do not fit in a segment with room for %d" % (len(values), self.capacity))
+
+        buf = self.shm.buf
+        self.seq += 1
+        struct.pack_into('<Q', buf, SEQ_OFFSET, self.seq)
+        if len(values) != len(self.slots) or any(key not in self.slots for key in values):
+            self.slots = dict((key, islot) for islot, key in enumerate(sorted(values.keys())))
+            for (roller_name, label), islot in self.slots.items():
+                ENTRY.pack_into(buf, HEADER.size + islot*ENTRY.size,
+                    encode_field(roller_name, NAME_SIZE), encode_field(label, LABEL_SIZE), values[(roller_name, label)])
+            self.generation += 1
+            struct.pack_into('<II', buf, COUNT_OFFSET, len(self.slots), self.generation)
+        else:
+            for key, islot in self.slots.items():
+                VALUE.pack_into(buf, HEADER.size + islot*ENTRY.size + VALUE_OFFSET, values[key])
+        self.seq += 1
+        struct.pack_into('<Q', buf, SEQ_OFFSET, self.seq)
+
+    def close(self, unlink=True):
+        """Detach from the segment, removing it unless `unlink` is False.
+        """
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+            PUBLISHED_SEGMENTS.discard(self.name)
+
+
+##########
+# Reader
+##########
+
+class SharedRollerReader(object):
+    """Reads rolled values published by a SharedRollerPublisher, possibly in another process.
+    """
+    def __init__(self, name=DEFAULT_SEGMENT_NAME):
+        check_shared_memory()
+        self.shm = attach_untracked(name)
+        magic, _, _, _ = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC:
+            self.shm.close()
+            raise ValueError("Shared memory segment '%s' was not written by a SharedRollerPublisher" % (name))
+
+        # Layout generation the index was built for
+        self.generation = None
+
+        # Keys are roller names
+        # Values are lists of (label, value offset) pairs
+        self.index = dict()
+
+    def snapshot(self):
+        """Return a consistent copy of the published entries as (name, label, value) tuples.
+        """
+        buf = self.shm.buf
+        for _ in range(MAX_READ_ATTEMPTS):
+            _, seq_start, count, _ = HEADER.unpack_from(buf, 0)
+            if seq_start % 2 == 0:
+                data = bytes(buf[HEADER.size:HEADER.size + count*ENTRY.size])
+                seq_end, = struct.unpack_from('<Q', buf, SEQ_OFFSET)
+                if seq_start == seq_end:
+                    return [(decode_field(name), decode_field(label), value)
+                            for name, label, value in ENTRY.iter_unpack(data)]
+            time.sleep(0)
+        raise RuntimeError("Timed out waiting for a consistent read of the shared memory segment")
+
+    def update_index(self):
+        """Rebuild the name to value offset index if the publisher changed the layout.
+        """
+        buf = self.shm.buf
+        for _ in range(MAX_READ_ATTEMPTS):
+            _, seq_start, count, generation = HEADER.unpack_from(buf, 0)
+            if generation == self.generation:
+                return
+            if seq_start % 2 == 0:
+                data = bytes(buf[HEADER.size:HEADER.size + count*ENTRY.size])
+                seq_end, = struct.unpack_from('<Q', buf, SEQ_OFFSET)
+                if seq_start == seq_end:
+                    index = dict()
+                    for ientry, (name, label, _) in enumerate(ENTRY.iter_unpack(data)):
+                        offset = HEADER.size + ientry*ENTRY.size + VALUE_OFFSET
+                        index.setdefault(decode_field(name), []).append((decode_field(label), offset))
+                    self.index = index
+                    self.generation = generation
+                    return
+            time.sleep(0)
+        raise RuntimeError("Timed out waiting for a consistent read of the shared memory segment")
+
+    def read(self):
+        """Return all rolled values keyed by roller name.
+        Counter rollers map to a float, histogram rollers map to a dict keyed by 'le' value.
+        """
+        values = dict()
+        for name, label, value in self.snapshot():
+            if label == '':
+                values[name] = value
+            else:
+                values.setdefault(name, dict())[label] = value
+        return values
+
+    def get(self, name, default=None):
+        """Return the rolled value(s) for a single roller, reading only its own entries.
+        """
+        buf = self.shm.buf
+        for _ in range(MAX_READ_ATTEMPTS):
+            self.update_index()
+            _, seq_start, _, generation = HEADER.unpack_from(buf, 0)
+            if seq_start % 2 or generation != self.generation:
+                time.sleep(0)
+                continue
+
+            entries = self.index.get(name)
+            if entries is None:
+                value = default
+            elif len(entries) == 1 and entries[0][0] == '':
+                value, = VALUE.unpack_from(buf, entries[0][1])
+            else:
+                value = dict((label, VALUE.unpack_from(buf, offset)[0]) for label, offset in entries)
+
+            seq_end, = struct.unpack_from('<Q', buf, SEQ_OFFSET)
+            if seq_start == seq_end:
+                return value
+            time.sleep(0)
+        raise RuntimeError("Timed out waiting for a consistent read of the shared memory segment")
+
+    def close(self):
+        self.shm.close()
@@ -1,23 +1,84 @@
 from __future__ import division, print_function
 
 import time
+import timeit
+import logging
 import threading
 from threading import Lock
-from fractions import gcd
+try:
+    from math import gcd
+except ImportError:
+    # python < 3.5
+    from fractions import gcd
+from prometheus_client import REGISTRY
 from .roller import ROLLER_REGISTRY
+from .clock import SYSTEM_CLOCK
+from .health import RollerHealth, get_updater_metrics, DEFAULT_MAX_FAILURES, DEFAULT_MAX_OVERRUNS, \
+    DEFAULT_LATENCY_BUDGET, DEFAULT_QUARANTINE_PERIOD
+
+logger = logging.getLogger(__name__)
 
 # Don't wait longer than every 30 seconds in between checks
 MAX_WAIT_PERIOD = 30
 
+# Check that the updater thread is alive every 10 seconds
+DEFAULT_WATCHDOG_PERIOD = 10
+
+# The updater is stalled if a tick hasn't finished in twice its wait period
+STALL_FACTOR = 2
+
 
 class PrometheusRollingMetricsUpdater(threading.Thread):
     """Thread used to periodically update a list of roller objects.
+
+    Pass `publisher` (e.g. a SharedRollerPublisher) to have rolled values published after
+    every round of updates.
+
+    Pass `adaptive=True` to skip recalculating rolled values for rollers whose source metric has
+    not changed over their whole retention window. Sources are still read every update period,
+    so rolled values are the same as without it and changes are picked up immediately.
+
+    Pass `clock` (e.g. a SimulatedClock shared with the rollers) to run on something other than
+    the real time.
+
+    Exceptions raised by a roller are logged and don't affect other rollers. A roller that fails
+    `max_failures` times in a row, or takes longer than `latency_budget` seconds `max_overruns`
+    times in a row, is quarantined for `quarantine_seconds`. The quarantine doubles each time the
+    roller misbehaves again after being retried, and resets once it updates cleanly.
+    Set `latency_budget` to None to disable latency checks, and `isolate_failures` to False to
+    raise roller exceptions instead.
+
+    Pass `registry` to export metrics on roller errors, overruns and quarantines. Updaters
+    using the same registry share these metrics.
     """
     def __init__(self, **kwargs):
         super(PrometheusRollingMetricsUpdater, self).__init__()
         self.rollers = []
+        self.publisher = kwargs.get('publisher')
+        self.adaptive = kwargs.get('adaptive', False)
+        self.clock = kwargs.get('clock', SYSTEM_CLOCK)
+        self.max_failures = kwargs.get('max_failures', DEFAULT_MAX_FAILURES)
+        self.max_overruns = kwargs.get('max_overruns', DEFAULT_MAX_OVERRUNS)
+        self.latency_budget = kwargs.get('latency_budget', DEFAULT_LATENCY_BUDGET)
+        self.quarantine_seconds = kwargs.get('quarantine_seconds', DEFAULT_QUARANTINE_PERIOD)
+        self.isolate_failures = kwargs.get('isolate_failures', True)
         self._lock = Lock()
 
+        if self.max_failures < 1 or self.max_overruns < 1:
+            raise ValueError("'max_failures' and 'max_overruns' must be > 0")
+
+        self.metrics = None
+        if kwargs.get('registry') is not None:
+            self.metrics = get_updater_metrics(kwargs['registry'])
+
+        # Keys are roller names
+        # Values are RollerHealth objects
+        self.health = dict()
+
+        # Real time the last tick finished, and the roller being updated right now
+        self.heartbeat = None
+        self.current_roller = None
+
         # The smallest time to wait between checks
         self.update_wait_period()
 
@@ -54,32 +115,196 @@ class PrometheusRollingMetricsUpdater(threading.Thread):
                     idx = ir
             if idx >= 0:
                 self.rollers.pop(idx)
+            self.health.pop(roller.name, None)
             self.update_wait_period()
 
+        if self.metrics is not None:
+            try:
+                self.metrics.quarantined.remove(roller.name)
+            except KeyError:
+                pass
+
+    def update(self, roller):
+        """Update a single roller that is due.
+        """
+        if self.adaptive:
+            roller.collect(skip_unchanged=True)
+        else:
+            roller.collect()
+
+    def update_isolated(self, roller, now):
+        """Update a single roller that is due, unless it is quarantined.
+        Failed and slow updates are recorded rather than raised.
+        Returns how long the update took.
+        """
+        health = self.health.get(roller.name)
+        if health is None:
+            health = self.health[roller.name] = RollerHealth(self.quarantine_seconds)
+
+        if health.is_quarantined(now):
+            return 0.0
+        if health.quarantined_until is not None:
+            health.quarantined_until = None
+            if self.metrics is not None:
+                self.metrics.quarantined.labels({'roller': roller.name}).set(0)
+
+        started = timeit.default_timer()
+        try:
+            self.update(roller)
+        except Exception:
+            if not self.isolate_failures:
+                raise
+            logger.exception("Failed to update roller '%s'", roller.name)
+            health.failures += 1
+            if self.metrics is not None:
+                self.metrics.errors.labels({'roller': roller.name}).inc()
+        else:
+            health.failures = 0
+        elapsed = timeit.default_timer() - started
+
+        if self.latency_budget is not None and elapsed > self.latency_budget:
+            health.overruns += 1
+            if self.metrics is not None:
+                self.metrics.overruns.labels({'roller': roller.name}).inc()
+        else:
+            health.overruns = 0
+
+        if health.failures >= self.max_failures or health.overruns >= self.max_overruns:
+            health.quarantine(now)
+            logger.warning("Quarantined roller '%s' until %s (%d failures, %d overruns in a row)",
+                roller.name, health.quarantined_until, health.failures, health.overruns)
+            if self.metrics is not None:
+                self.metrics.quarantines.labels({'roller': roller.name}).inc()
+                self.metrics.quarantined.labels({'roller': roller.name}).set(1)
+        elif health.failures == 0 and health.overruns == 0:
+            health.quarantine_seconds = self.quarantine_seconds
+
+        return elapsed
+
+    def tick(self):
+        """Execute any updates that need to take place at the current time.
+        """
+        now = self.clock.time()
+        now_second = int(now)
+        with self._lock:
+            started = timeit.default_timer()
+            slowest = 0.0
+            for roller in self.rollers:
+                if now_second % roller.update_seconds == 0:
+                    self.current_roller = roller
+                    slowest = max(slowest, self.update_isolated(roller, now))
+            self.current_roller = None
+
+            if self.metrics is not None:
+                self.metrics.tick_duration.observe(timeit.default_timer() - started)
+                self.metrics.slowest_update.set(slowest)
+
+            if self.publisher is not None:
+                try:
+                    self.publisher.publish()
+                except Exception:
+                    logger.exception("Failed to publish rolled values")
+                    if self.metrics is not None:
+                        self.metrics.publish_errors.inc()
+
+        self.heartbeat = time.time()
+        if self.metrics is not None:
+            self.metrics.last_tick.set(self.heartbeat)
+
+    def is_stalled(self):
+        """True if the loop is running but no tick has finished for STALL_FACTOR wait periods,
+        e.g. because a roller's collect() is hanging.
+        """
+        return self.heartbeat is not None and time.time() - self.heartbeat > STALL_FACTOR*self.wait_period
+
     def run(self):
         """Run forever, executing any updates that need to take place and then sleeping
         until the next update time.
         """
+        self.heartbeat = time.time()
         while True:
-            now_second = int(time.time())
-            with self._lock:
-                for roller in self.rollers:
-                    if now_second % roller.update_seconds == 0:
-                        roller.collect()
+            self.tick()
 
             # Sleep until next period
-            time.sleep(self.wait_period - time.time() % self.wait_period)
+            self.clock.sleep(self.wait_period - self.clock.time() % self.wait_period)
+
+
+class UpdaterWatchdog(threading.Thread):
+    """Thread that restarts the updater loop if its thread dies.
+    Threads can only be started once, so the same updater is run in a new thread, available
+    as `thread`; the updater object itself stays the one to add and remove rollers on.
+
+    A loop that is alive but has stopped finishing ticks can't be safely restarted, since it
+    holds the updater's lock. It is logged and reported with the stalled gauge instead.
+    """
+    def __init__(self, updater, check_seconds=DEFAULT_WATCHDOG_PERIOD):
+        super(UpdaterWatchdog, self).__init__()
+        self.updater = updater
+        self.thread = updater
+        self.check_seconds = check_seconds
+        self.restarts = 0
+        self.stalled = False
+        self.daemon = True
+
+    def check(self):
+        """Restart the updater loop if its thread is not running. Returns True if it was restarted.
+        """
+        if self.thread.is_alive():
+            self.check_stalled()
+            return False
+
+        logger.error("Rolling metrics updater thread died, restarting it")
+        self.thread = threading.Thread(target=self.updater.run, name=self.updater.name)
+        self.thread.daemon = self.updater.daemon
+        self.thread.start()
+        self.restarts += 1
+        if self.updater.metrics is not None:
+            self.updater.metrics.restarts.inc()
+        return True
+
+    def check_stalled(self):
+        """Report whether the updater loop has stopped finishing ticks, logging when it first does.
+        """
+        stalled = self.updater.is_stalled()
+        if stalled and not self.stalled:
+            current_roller = self.updater.current_roller
+            logger.error("Rolling metrics updater has not finished a tick since %s, stuck updating roller '%s'",
+                self.updater.heartbeat, current_roller.name if current_roller is not None else None)
+        elif self.stalled and not stalled:
+            logger.warning("Rolling metrics updater is finishing ticks again")
+        self.stalled = stalled
 
+        if self.updater.metrics is not None:
+            self.updater.metrics.stalled.set(1 if stalled else 0)
+        return stalled
 
-def start_update_daemon(updater=None, roller_registry=ROLLER_REGISTRY):
-    """Start updating rolled metrics in daemon thread
+    def run(self):
+        # Liveness is about real time, even if the updater runs on a simulated clock
+        while True:
+            time.sleep(self.check_seconds)
+            self.check()
+
+
+def start_update_daemon(updater=None, roller_registry=ROLLER_REGISTRY, watchdog=True, **kwargs):
+    """Start updating rolled metrics in daemon thread.
+    Extra keyword arguments are passed to PrometheusRollingMetricsUpdater; health metrics are
+    exported to the default prometheus registry unless another `registry` is given. Calling this
+    more than once is fine, the updaters share the same health metrics.
+
+    Unless `watchdog` is False, a second daemon thread restarts the updater if it dies,
+    available as `updater.watchdog`.
     """
     if updater is None:
-        updater = PrometheusRollingMetricsUpdater()
+        kwargs.setdefault('registry', REGISTRY)
+        updater = PrometheusRollingMetricsUpdater(**kwargs)
         for roller in roller_registry.values():
             updater.add(roller)
 
     updater.daemon = True
     updater.start()
 
+    if watchdog:
+        updater.watchdog = UpdaterWatchdog(updater)
+        updater.watchdog.start()
+
     return updater
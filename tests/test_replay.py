@@ -0,0 +1,139 @@
+import unittest
+
+from prometheus_roller.replay import Replay
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        # Counter increases by 1 every second for 10 minutes, then stays flat
+        self.trace = []
+        for i in range(1200):
+            self.trace.append((i, {
+                'requests': float(min(i, 600)),
+                'latency': {'0.5': min(i, 600), '+Inf': 2*min(i, 600)}
+            }))
+
+    def test_run(self):
+        replay = Replay(self.trace)
+        rc = replay.add_roller('requests')
+        rh = replay.add_roller('latency', options={'reducer': 'max'})
+
+        result = replay.run()
+
+        self.assertEqual(result.points, 1200)
+        self.assertEqual(result.ticks, 240)
+        self.assertEqual(len(result.outputs), 1200)
+        self.assertTrue(result.ticks_per_second > 0)
+
+        # Default window is 5 minutes, collected every 5 seconds
+        seconds, outputs = result.outputs[599]
+        self.assertEqual(seconds, 599)
+        self.assertEqual(outputs[rc.name][''], 300.0)
+        self.assertEqual(outputs[rh.name], {'0.5': 5.0, '+Inf': 10.0})
+
+        # Window has slid past the last change
+        _, outputs = result.outputs[-1]
+        self.assertEqual(outputs[rc.name][''], 0.0)
+        self.assertEqual(outputs[rh.name], {'0.5': 0.0, '+Inf': 0.0})
+
+    def test_unaligned_timestamps(self):
+        # Points every 10 seconds, none of them on a multiple of the 5 second update period
+        start = 1697712343
+        trace = []
+        for i in range(200):
+            trace.append((start + 10*i, {'requests': float(i)}))
+
+        replay = Replay(trace)
+        r = replay.add_roller('requests')
+        result = replay.run()
+
+        # Ticks from the first multiple of 5 after the first point to the last one before the
+        # last point
+        self.assertEqual(result.ticks, 398)
+        self.assertEqual(len(r.past_values), 61)
+
+        # 1 per point over the last 5 minutes
+        self.assertEqual(result.outputs[-1][1][r.name], {'': 30.0})
+
+    def test_bucket_added_later(self):
+        trace = [
+            (0, {'latency': {'0.5': 0, '+Inf': 0}}),
+            (1, {'latency': {'0.5': 3, '+Inf': 3}}),
+            (2, {'latency': {'0.5': 3, '1.0': 4, '+Inf': 5}}),
+        ]
+        replay = Replay(trace)
+        r = replay.add_roller('latency', options={'update_seconds': 1})
+        result = replay.run()
+
+        self.assertEqual(result.outputs[1][1][r.name], {'0.5': 3.0, '1.0': 0.0, '+Inf': 3.0})
+        self.assertEqual(result.outputs[2][1][r.name], {'0.5': 3.0, '1.0': 4.0, '+Inf': 5.0})
+
+    def test_failures_are_raised(self):
+        trace = [(i, {'requests': float(i)}) for i in range(10)]
+        replay = Replay(trace)
+        r = replay.add_roller('requests', options={'update_seconds': 1})
+
+        def fail(*args, **kwargs):
+            raise RuntimeError('broken reducer')
+        r.reducer = fail
+        self.assertRaises(RuntimeError, replay.run)
+
+    def test_late_metric(self):
+        trace = [(0, {'requests': 0.0})]
+        for i in range(1, 20):
+            trace.append((i, {'requests': float(i), 'latency': {'0.5': i, '+Inf': i}}))
+
+        replay = Replay(trace)
+        rc = replay.add_roller('requests', options={'update_seconds': 1})
+        rh = replay.add_roller('latency', options={'update_seconds': 1})
+        result = replay.run()
+
+        self.assertEqual(result.outputs[0][1][rh.name], {'0.5': 0.0, '+Inf': 0.0})
+        self.assertEqual(result.outputs[-1][1][rh.name], {'0.5': 19.0, '+Inf': 19.0})
+        self.assertEqual(result.outputs[-1][1][rc.name], {'': 19.0})
+
+    def test_adaptive_matches(self):
+        # Flat for longer than the window, then changes every 7 seconds for a while, then flat
+        # again until the window has slid past every change
+        trace = []
+        value = 0.0
+        for i in range(1800):
+            if 700 <= i < 1100 and i % 7 == 0:
+                value += 1
+            trace.append((i, {
+                'requests': value,
+                'latency': {'0.5': value, '+Inf': 2*value}
+            }))
+
+        for reducer in ('sum', 'avg', 'max', 'ema'):
+            results = []
+            for adaptive in (False, True):
+                replay = Replay(trace, adaptive=adaptive)
+                replay.add_roller('requests', options={'reducer': reducer})
+                replay.add_roller('latency', options={'reducer': reducer})
+                results.append(replay.run().outputs)
+            self.assertEqual(results[0], results[1])
+
+    def test_adaptive_matches_with_reset(self):
+        # The counter resets to 0 and then stays flat, so the oldest and newest values in the
+        # window match while it still holds nonzero deltas
+        trace = []
+        for i in range(900):
+            value = 0.0
+            if 20 <= i < 40:
+                value = 4.0
+            elif 40 <= i < 60:
+                value = 3.0
+            trace.append((i, {'requests': value}))
+
+        for reducer in ('sum', 'avg', 'max', 'min', 'ema'):
+            results = []
+            for adaptive in (False, True):
+                replay = Replay(trace, adaptive=adaptive)
+                replay.add_roller('requests', options={'reducer': reducer})
+                results.append(replay.run().outputs)
+            self.assertEqual(results[0], results[1])
+
+if __name__ == '__main__':
+    unittest.main()
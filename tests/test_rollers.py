@@ -4,7 +4,7 @@ import datetime
 from collections import deque
 
 from prometheus_client import Histogram, Counter, REGISTRY, CollectorRegistry
-from prometheus_roller import HistogramRoller, CounterRoller
+from prometheus_roller import HistogramRoller, CounterRoller, SimulatedClock
 from prometheus_roller.roller import sum_total, average, min_value, max_value, ema, remove_old_values
 
 
@@ -163,6 +163,21 @@ class TestHistogram(unittest.TestCase):
                         nchecks += 1
         self.assertTrue(nchecks > 0)
 
+    def test_skip_unchanged(self):
+        h = Histogram('test_value', 'Testing roller', registry=self.registry)
+        roller = HistogramRoller(h, registry=self.registry)
+
+        roller.collect()
+        self.assertFalse(roller.is_flat())
+        roller.collect()
+        self.assertTrue(roller.is_flat())
+
+        h.observe(1)
+        roller.collect(skip_unchanged=True)
+        self.assertFalse(roller.is_flat())
+        self.assertEqual(roller.rolled_values['1.0'], 1.0)
+        self.assertEqual(roller.rolled_values['0.5'], 0.0)
+
 
 class TestCounter(unittest.TestCase):
 
@@ -223,6 +238,46 @@ class TestCounter(unittest.TestCase):
                     nchecks += 1
         self.assertTrue(nchecks > 0)
 
+    def test_skip_unchanged(self):
+        c = Counter('test_value', 'Testing roller', registry=self.registry)
+        r = CounterRoller(c, registry=self.registry)
+
+        r.collect()
+        self.assertFalse(r.is_flat())
+        r.collect()
+        self.assertTrue(r.is_flat())
+
+        # Values are still recorded while flat
+        r.collect(skip_unchanged=True)
+        self.assertEqual(len(r.past_values), 3)
+        self.assertTrue(r.is_flat())
+
+        c.inc()
+        r.collect(skip_unchanged=True)
+        self.assertFalse(r.is_flat())
+        self.assertEqual(r.rolled_values[''], 1.0)
+
+    def test_clock(self):
+        c = Counter('test_value', 'Testing roller', registry=self.registry)
+        clock = SimulatedClock()
+        r = CounterRoller(c, registry=self.registry, clock=clock, options={
+            'retention_seconds': 10
+        })
+
+        r.collect()
+        c.inc(3)
+        clock.advance(5)
+        r.collect()
+        self.assertEqual(r.rolled_values[''], 3.0)
+
+        # The increase drops out of the window
+        clock.advance(5)
+        r.collect()
+        self.assertEqual(r.rolled_values[''], 3.0)
+        clock.advance(5)
+        r.collect()
+        self.assertEqual(r.rolled_values[''], 0.0)
+
 
 class TestWindowing(unittest.TestCase):
 
@@ -0,0 +1,143 @@
+import os
+import logging
+import unittest
+
+from prometheus_client import Histogram, Counter, CollectorRegistry
+from prometheus_roller import HistogramRoller, CounterRoller, SharedRollerPublisher, SharedRollerReader
+from prometheus_roller import shared
+
+
+@unittest.skipIf(shared.shared_memory is None, 'multiprocessing.shared_memory is not available')
+class TestSharedRollers(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.roller_registry = {}
+        self.segment_name = 'prometheus_roller_test_%d' % (os.getpid())
+        self.publisher = SharedRollerPublisher(
+            name=self.segment_name,
+            size=4096,
+            roller_registry=self.roller_registry
+        )
+        self.reader = SharedRollerReader(name=self.segment_name)
+
+    def tearDown(self):
+        self.reader.close()
+        self.publisher.close()
+
+    def test_read_empty(self):
+        self.assertEqual(self.reader.read(), {})
+        self.assertEqual(self.reader.get('missing'), None)
+
+    def test_publish(self):
+        c = Counter('test_counter', 'Testing roller', registry=self.registry)
+        h = Histogram('test_hist', 'Testing roller', registry=self.registry)
+        rc = CounterRoller(c, registry=self.registry, roller_registry=self.roller_registry)
+        rh = HistogramRoller(h, registry=self.registry, roller_registry=self.roller_registry)
+
+        rc.collect()
+        rh.collect()
+        c.inc(3)
+        h.observe(0.3)
+        rc.collect()
+        rh.collect()
+        self.publisher.publish()
+
+        self.assertEqual(self.reader.get('test_counter_sum_rolled'), 3.0)
+
+        hist_values = self.reader.get('test_hist_sum_rolled')
+        self.assertEqual(hist_values, rh.rolled_values)
+        self.assertEqual(hist_values['0.25'], 0.0)
+        self.assertEqual(hist_values['0.5'], 1.0)
+
+        # Values are replaced on the next publish
+        c.inc(2)
+        rc.collect()
+        self.publisher.publish()
+        self.assertEqual(self.reader.get('test_counter_sum_rolled'), 5.0)
+
+    def test_capacity(self):
+        h = Histogram('test_hist', 'Testing roller', registry=self.registry)
+        rh = HistogramRoller(h, registry=self.registry, roller_registry=self.roller_registry)
+        rh.collect()
+
+        small = SharedRollerPublisher(
+            name=self.segment_name + '_small',
+            size=256,
+            roller_registry=self.roller_registry
+        )
+        try:
+            self.assertRaises(ValueError, small.publish)
+        finally:
+            small.close()
+
+    def test_existing_segment(self):
+        self.assertRaises(FileExistsError, SharedRollerPublisher,
+            name=self.segment_name, size=4096, roller_registry=self.roller_registry)
+
+        c = Counter('test_counter', 'Testing roller', registry=self.registry)
+        rc = CounterRoller(c, registry=self.registry, roller_registry=self.roller_registry)
+        rc.collect()
+
+        takeover = SharedRollerPublisher(name=self.segment_name, size=4096, roller_registry=self.roller_registry,
+            takeover=True)
+        takeover.publish()
+        self.assertEqual(self.reader.get('test_counter_sum_rolled'), 0.0)
+        takeover.close(unlink=False)
+
+    def test_get_from_large_segment(self):
+        class FakeRoller(object):
+            def __init__(self, rolled_values):
+                self.rolled_values = rolled_values
+
+        publisher = SharedRollerPublisher(
+            name=self.segment_name + '_large',
+            roller_registry=dict(
+                ('roller_%d' % (i), FakeRoller({'': float(i)})) for i in range(5000)
+            )
+        )
+        reader = SharedRollerReader(name=self.segment_name + '_large')
+        try:
+            publisher.publish()
+            self.assertEqual(reader.get('roller_4321'), 4321.0)
+            generation = reader.generation
+
+            # Changing values keeps the layout, so the index is reused
+            publisher.roller_registry['roller_4321'].rolled_values[''] = -1.0
+            publisher.publish()
+            self.assertEqual(reader.get('roller_4321'), -1.0)
+            self.assertEqual(reader.generation, generation)
+
+            # Adding a roller changes the layout
+            publisher.roller_registry['roller_new'] = FakeRoller({'': 7.0})
+            publisher.publish()
+            self.assertEqual(reader.get('roller_new'), 7.0)
+            self.assertEqual(reader.get('roller_4321'), -1.0)
+            self.assertNotEqual(reader.generation, generation)
+            self.assertEqual(len(reader.read()), 5001)
+        finally:
+            reader.close()
+            publisher.close()
+
+    def test_name_too_long(self):
+        c = Counter('test_counter', 'Testing roller', registry=self.registry)
+        c_long = Counter('test_' + 'x'*200, 'Testing roller', registry=self.registry)
+        rc = CounterRoller(c, registry=self.registry, roller_registry=self.roller_registry)
+        rc_long = CounterRoller(c_long, registry=self.registry, roller_registry=self.roller_registry)
+        rc.collect()
+        rc_long.collect()
+
+        logging.disable(logging.CRITICAL)
+        try:
+            self.publisher.publish()
+            self.publisher.publish()
+        finally:
+            logging.disable(logging.NOTSET)
+
+        self.assertEqual(self.reader.get('test_counter_sum_rolled'), 0.0)
+        self.assertEqual(self.reader.get(rc_long.name), None)
+        self.assertEqual(self.publisher.rejected, set([(rc_long.name, '')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
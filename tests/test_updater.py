@@ -1,8 +1,13 @@
+import time
+import logging
+import threading
 import unittest
 
-from prometheus_client import Histogram, REGISTRY, CollectorRegistry
-from prometheus_roller import HistogramRoller, start_update_daemon, PrometheusRollingMetricsUpdater
-from prometheus_roller.updater import MAX_WAIT_PERIOD
+from prometheus_client import Histogram, Counter, REGISTRY, CollectorRegistry
+from prometheus_roller import HistogramRoller, CounterRoller, start_update_daemon, PrometheusRollingMetricsUpdater, \
+    SimulatedClock
+from prometheus_roller.roller import sum_total
+from prometheus_roller.updater import MAX_WAIT_PERIOD, UpdaterWatchdog
 
 
 class TestRollingUpdater(unittest.TestCase):
@@ -57,6 +62,238 @@ class TestRollingUpdater(unittest.TestCase):
         self.assertEqual(len(t.rollers), 2)
         self.assertEqual(t.wait_period, 2)
 
+    def test_adaptive(self):
+        c = Counter('test_value', 'Testing roller', registry=self.registry)
+        r = CounterRoller(c, registry=self.registry, roller_registry=self.roller_registry)
+
+        reduced = []
+        def counting_sum(deltas, **kwargs):
+            reduced.append(True)
+            return sum_total(deltas)
+        r.reducer = counting_sum
+
+        t = PrometheusRollingMetricsUpdater(adaptive=True)
+        t.add(r)
+
+        # Not flat until there are 2 values in the window
+        t.update(r)
+        t.update(r)
+        self.assertEqual(len(reduced), 2)
+
+        # The counter is still read, but the rolled value is not recalculated
+        for _ in range(3):
+            t.update(r)
+        self.assertEqual(len(reduced), 2)
+        self.assertEqual(len(r.past_values), 5)
+        self.assertEqual(r.rolled_values[''], 0.0)
+
+        # A change is picked up on the next update
+        c.inc(2)
+        t.update(r)
+        self.assertEqual(len(reduced), 3)
+        self.assertEqual(r.rolled_values[''], 2.0)
+
+    def test_not_adaptive(self):
+        c = Counter('test_value', 'Testing roller', registry=self.registry)
+        r = CounterRoller(c, registry=self.registry, roller_registry=self.roller_registry)
+
+        t = PrometheusRollingMetricsUpdater()
+        t.add(r)
+        for _ in range(5):
+            t.update(r)
+        self.assertEqual(len(r.past_values), 5)
+
+
+class TestFaultIsolation(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.roller_registry = {}
+        self.clock = SimulatedClock()
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def make_roller(self, name):
+        c = Counter(name, 'Testing roller', registry=self.registry)
+        return c, CounterRoller(c, registry=self.registry, roller_registry=self.roller_registry, clock=self.clock,
+            options={'update_seconds': 1})
+
+    def get_value(self, name, roller):
+        return self.registry.get_sample_value(name, {'roller': roller.name})
+
+    def test_failing_roller_is_isolated(self):
+        c_good, r_good = self.make_roller('test_value_good')
+        _, r_bad = self.make_roller('test_value_bad')
+
+        def fail():
+            raise RuntimeError('broken source')
+        r_bad.collect = fail
+
+        t = PrometheusRollingMetricsUpdater(clock=self.clock, registry=self.registry, quarantine_seconds=10)
+        t.add(r_bad)
+        t.add(r_good)
+
+        t.tick()
+        c_good.inc()
+        self.clock.advance(1)
+        t.tick()
+        self.assertEqual(r_good.rolled_values[''], 1.0)
+        self.assertEqual(self.get_value('prometheus_roller_update_errors', r_bad), 2.0)
+        self.assertEqual(self.get_value('prometheus_roller_quarantined', r_bad), None)
+
+        # Third failure in a row quarantines the roller
+        self.clock.advance(1)
+        t.tick()
+        self.assertEqual(t.health[r_bad.name].quarantined_until, 12)
+        self.assertEqual(self.get_value('prometheus_roller_quarantined', r_bad), 1.0)
+        self.assertEqual(self.get_value('prometheus_roller_quarantines', r_bad), 1.0)
+
+        # No updates while quarantined
+        for _ in range(9):
+            self.clock.advance(1)
+            t.tick()
+        self.assertEqual(self.get_value('prometheus_roller_update_errors', r_bad), 3.0)
+
+        # Retried after the quarantine, failing again doubles it
+        self.clock.advance(1)
+        t.tick()
+        self.assertEqual(self.get_value('prometheus_roller_update_errors', r_bad), 4.0)
+        self.assertEqual(t.health[r_bad.name].quarantined_until, 32)
+
+        # Recovering resets the quarantine period
+        del r_bad.collect
+        self.clock.set(32)
+        t.tick()
+        self.assertEqual(self.get_value('prometheus_roller_quarantined', r_bad), 0.0)
+        self.assertEqual(t.health[r_bad.name].failures, 0)
+        self.assertEqual(t.health[r_bad.name].quarantine_seconds, 10)
+
+    def test_slow_roller_is_quarantined(self):
+        _, r = self.make_roller('test_value')
+
+        collect = r.collect
+        def slow_collect():
+            time.sleep(0.01)
+            collect()
+        r.collect = slow_collect
+
+        t = PrometheusRollingMetricsUpdater(clock=self.clock, registry=self.registry, latency_budget=0.005,
+            max_overruns=2)
+        t.add(r)
+
+        t.tick()
+        self.assertEqual(t.health[r.name].overruns, 1)
+        self.assertFalse(t.health[r.name].is_quarantined(self.clock.time()))
+        self.clock.advance(1)
+        t.tick()
+        self.assertTrue(t.health[r.name].is_quarantined(self.clock.time()))
+        self.assertEqual(self.get_value('prometheus_roller_update_overruns', r), 2.0)
+        self.assertTrue(self.registry.get_sample_value('prometheus_roller_slowest_update_seconds') > 0.005)
+        self.assertEqual(self.registry.get_sample_value('prometheus_roller_tick_duration_seconds_count'), 2.0)
+
+    def test_publish_errors(self):
+        class BrokenPublisher(object):
+            def publish(self):
+                raise RuntimeError('segment full')
+
+        t = PrometheusRollingMetricsUpdater(clock=self.clock, registry=self.registry, publisher=BrokenPublisher())
+        t.tick()
+        self.assertEqual(self.registry.get_sample_value('prometheus_roller_publish_errors'), 1.0)
+
+    def test_watchdog(self):
+        _, r = self.make_roller('test_value')
+        t = PrometheusRollingMetricsUpdater(registry=self.registry)
+        t.add(r)
+        t.daemon = True
+
+        # The updater was never started, so it looks dead
+        watchdog = UpdaterWatchdog(t)
+        self.assertTrue(watchdog.check())
+        self.assertTrue(watchdog.updater is t)
+        self.assertTrue(watchdog.thread is not t)
+        self.assertTrue(watchdog.thread.is_alive())
+        self.assertEqual(watchdog.restarts, 1)
+        self.assertEqual(self.registry.get_sample_value('prometheus_roller_updater_restarts'), 1.0)
+
+        self.assertFalse(watchdog.check())
+
+    def test_stalled(self):
+        _, r = self.make_roller('test_value')
+        released = threading.Event()
+        collecting = threading.Event()
+        def hang(*args, **kwargs):
+            collecting.set()
+            released.wait(5)
+        r.collect = hang
+
+        t = PrometheusRollingMetricsUpdater(registry=self.registry)
+        t.add(r)
+        t.daemon = True
+        watchdog = UpdaterWatchdog(t)
+
+        t.start()
+        self.assertTrue(collecting.wait(5))
+        self.assertFalse(watchdog.check_stalled())
+
+        # Pretend the tick has been hanging for longer than the stall limit
+        t.heartbeat = time.time() - 10
+        self.assertFalse(watchdog.check())
+        self.assertTrue(watchdog.stalled)
+        self.assertTrue(t.current_roller is r)
+        self.assertEqual(self.registry.get_sample_value('prometheus_roller_updater_stalled'), 1.0)
+
+        released.set()
+        for _ in range(50):
+            if not t.is_stalled():
+                break
+            time.sleep(0.1)
+        self.assertFalse(watchdog.check_stalled())
+        self.assertEqual(self.registry.get_sample_value('prometheus_roller_updater_stalled'), 0.0)
+        self.assertEqual(self.registry.get_sample_value('prometheus_roller_updater_last_tick_timestamp_seconds'),
+            t.heartbeat)
+
+    def test_remove_quarantined(self):
+        _, r = self.make_roller('test_value')
+        def fail():
+            raise RuntimeError('broken source')
+        r.collect = fail
+
+        t = PrometheusRollingMetricsUpdater(clock=self.clock, registry=self.registry, max_failures=1)
+        t.add(r)
+        t.tick()
+        self.assertEqual(self.get_value('prometheus_roller_quarantined', r), 1.0)
+
+        t.remove(r)
+        self.assertEqual(self.get_value('prometheus_roller_quarantined', r), None)
+
+        # Removing a roller that was never quarantined is fine too
+        t.add(r)
+        t.remove(r)
+
+    def test_add_after_restart(self):
+        _, r_a = self.make_roller('test_value_a')
+        r_b = CounterRoller(Counter('test_value_b', 'Testing roller', registry=self.registry),
+            registry=self.registry, roller_registry=self.roller_registry, options={'update_seconds': 3})
+
+        t = PrometheusRollingMetricsUpdater(registry=self.registry)
+        t.daemon = True
+        watchdog = UpdaterWatchdog(t)
+        watchdog.check()
+
+        # The running loop uses the same updater, so its wait period follows the new roller
+        t.add(r_a)
+        self.assertEqual(t.wait_period, 1)
+        t.remove(r_a)
+        t.add(r_b)
+        self.assertEqual(t.wait_period, 3)
+        self.assertTrue(watchdog.thread.is_alive())
+
+    def test_start_update_daemon_twice(self):
+        t_a = start_update_daemon(registry=self.registry, roller_registry={}, watchdog=False)
+        t_b = start_update_daemon(registry=self.registry, roller_registry={}, watchdog=False)
+        self.assertTrue(t_a.metrics is t_b.metrics)
 
 if __name__ == '__main__':
     unittest.main()